@@ -1,13 +1,20 @@
 from __future__ import annotations
-import base64
-import io
+import asyncio
+import functools
+import multiprocessing
+import os
 import sys
 import pathlib
-from typing import Optional
-
-from fastapi import FastAPI, UploadFile, File, Form
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 import numpy as np
 import cv2
 
@@ -15,11 +22,50 @@ import cv2
 ROOT = pathlib.Path(__file__).resolve().parents[1]
 sys.path.append(str(ROOT))
 from scripts.enhance import (
+    encode_bgr,
     enhance,
-    bgr_to_rgb,
+    png_to_apng,
 )
 
-app = FastAPI(title="Image Enhancer API", version="1.0.0")
+
+# A couple of workers keep the loop free and let two requests overlap; each gets an even share of the
+# cores for cv2's own threading, so a single request still uses the whole machine. Keeping the pool
+# small also bounds how many large upscales can be held in memory at once
+_POOL_WORKERS = max(1, min(2, os.cpu_count() or 1))
+_WORKER_CV2_THREADS = max(1, (os.cpu_count() or 1) // _POOL_WORKERS)
+
+
+def _init_worker(num_threads: int) -> None:
+    cv2.setNumThreads(num_threads)
+
+
+def _make_pool() -> ProcessPoolExecutor:
+    # spawn, not fork: a CUDA context initialised in the parent does not survive fork
+    return ProcessPoolExecutor(
+        max_workers=_POOL_WORKERS,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(_WORKER_CV2_THREADS,),
+    )
+
+
+def _warm_pool(pool: ProcessPoolExecutor) -> List[Future]:
+    # Workers spawn lazily; submitting a no-op per worker starts them and pays the imports up front
+    return [pool.submit(os.getpid) for _ in range(_POOL_WORKERS)]
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # enhance() is CPU-bound and synchronous; run it in worker processes so the event loop stays free
+    app.state.pool = _make_pool()
+    await asyncio.gather(*(asyncio.wrap_future(fut) for fut in _warm_pool(app.state.pool)))
+    try:
+        yield
+    finally:
+        app.state.pool.shutdown()
+
+
+app = FastAPI(title="Image Enhancer API", version="1.0.0", lifespan=lifespan)
 
 # CORS for local frontend
 app.add_middleware(
@@ -34,11 +80,51 @@ app.add_middleware(
 )
 
 
+# Encoded results are kept in memory and served as binary, so responses carry URLs instead of base64 data URLs.
+# Each format is dropped once served, and the cache is bounded by entry count and total bytes
+_RESULT_CACHE_SIZE = 16
+_RESULT_CACHE_BYTES = 256 * 1024 * 1024
+_results: "OrderedDict[str, Dict[str, bytes]]" = OrderedDict()
+_results_bytes = 0
+
+_MIME_TYPES = {
+    "png": "image/png",
+    "jpg": "image/jpeg",
+    "webp": "image/webp",
+    "apng": "image/apng",
+}
+
+
+def _store_result(outputs: Dict[str, bytes]) -> str:
+    global _results_bytes
+    job_id = uuid.uuid4().hex
+    _results[job_id] = dict(outputs)
+    _results_bytes += sum(len(data) for data in outputs.values())
+    # Always keep the newest entry, even if it alone exceeds the byte budget
+    while len(_results) > 1 and (len(_results) > _RESULT_CACHE_SIZE or _results_bytes > _RESULT_CACHE_BYTES):
+        _, evicted = _results.popitem(last=False)
+        _results_bytes -= sum(len(data) for data in evicted.values())
+    return job_id
+
+
 @app.get("/api/health")
 def health():
     return {"status": "ok"}
 
 
+@app.get("/api/result/{job_id}/{fmt}")
+async def get_result(job_id: str, fmt: str):
+    global _results_bytes
+    outputs = _results.get(job_id)
+    if outputs is None or fmt not in outputs:
+        raise HTTPException(status_code=404, detail="Result not found")
+    data = outputs.pop(fmt)
+    _results_bytes -= len(data)
+    if not outputs:
+        del _results[job_id]
+    return Response(content=data, media_type=_MIME_TYPES[fmt])
+
+
 def _decode_image_to_bgr(data: bytes) -> np.ndarray:
     arr = np.frombuffer(data, dtype=np.uint8)
     img = cv2.imdecode(arr, cv2.IMREAD_COLOR)
@@ -47,10 +133,38 @@ def _decode_image_to_bgr(data: bytes) -> np.ndarray:
     return img
 
 
-def _pil_to_bytes(pil_img, format: str) -> bytes:
-    buf = io.BytesIO()
-    pil_img.save(buf, format=format)
-    return buf.getvalue()
+def _process_upload(data: bytes, **enhance_kwargs) -> Dict[str, bytes]:
+    # Runs in a worker process: only the upload bytes and the encoded outputs cross the process
+    # boundary, never the decoded or enhanced arrays
+    img_bgr = _decode_image_to_bgr(data)
+
+    img_enh_bgr = enhance(img_bgr, **enhance_kwargs)
+
+    # Encoders are independent C code that releases the GIL, so run them side by side
+    with ThreadPoolExecutor(max_workers=3) as ex:
+        # libpng via OpenCV at a moderate zlib level; takes the BGR array as-is
+        fut_png = ex.submit(encode_bgr, img_enh_bgr, ".png", [cv2.IMWRITE_PNG_COMPRESSION, 3])
+        # libjpeg-turbo via OpenCV; 4:4:4 sampling matches the previous subsampling=0
+        fut_jpg = ex.submit(encode_bgr, img_enh_bgr, ".jpg", [
+            cv2.IMWRITE_JPEG_QUALITY, 90,
+            cv2.IMWRITE_JPEG_OPTIMIZE, 1,
+            cv2.IMWRITE_JPEG_SAMPLING_FACTOR, cv2.IMWRITE_JPEG_SAMPLING_FACTOR_444,
+        ])
+        # libwebp's default effort (method 4); method 6 was several times slower for ~1-2% smaller files
+        fut_webp = ex.submit(encode_bgr, img_enh_bgr, ".webp", [cv2.IMWRITE_WEBP_QUALITY, 90])
+        png_bytes = fut_png.result()
+        jpg_bytes = fut_jpg.result()
+        webp_bytes = fut_webp.result()
+
+    # APNG (single frame), built directly from the PNG stream
+    apng_bytes = png_to_apng(png_bytes)
+
+    return {
+        "png": png_bytes,
+        "jpg": jpg_bytes,
+        "webp": webp_bytes,
+        "apng": apng_bytes,
+    }
 
 
 @app.post("/api/enhance")
@@ -67,10 +181,9 @@ async def enhance_endpoint(
     saturation: float = Form(1.05),
 ):
     data = await file.read()
-    img_bgr = _decode_image_to_bgr(data)
-
-    img_enh_bgr = enhance(
-        img_bgr,
+    job = functools.partial(
+        _process_upload,
+        data,
         scale=scale if (width is None and height is None) else None,
         target_w=width,
         target_h=height,
@@ -81,44 +194,17 @@ async def enhance_endpoint(
         sharpen_sigma=sharpen_sigma,
         sat_factor=saturation,
     )
-
-    from PIL import Image
-
-    img_rgb = bgr_to_rgb(img_enh_bgr)
-    pil_img = Image.fromarray(img_rgb)
-
-    # Encode PNG
-    png_bytes = _pil_to_bytes(pil_img, "PNG")
-    # JPG
-    jpg_buf = io.BytesIO()
-    pil_img.save(jpg_buf, format="JPEG", quality=90, subsampling=0, optimize=True)
-    jpg_bytes = jpg_buf.getvalue()
-    # WEBP
-    webp_buf = io.BytesIO()
-    pil_img.save(webp_buf, format="WEBP", quality=90, method=6)
-    webp_bytes = webp_buf.getvalue()
-
-    # APNG (single frame) using apng library
-    from apng import APNG, PNG
-    png_frame = PNG.from_bytes(png_bytes)
-    ap = APNG()
-    ap.append(png_frame, delay=100)
-    apng_io = io.BytesIO()
-    # apng library does not expose direct write to BytesIO in all versions, so write to temp and read back
-    import tempfile
-    with tempfile.NamedTemporaryFile(suffix=".apng", delete=True) as tf:
-        ap.save(tf.name)
-        tf.seek(0)
-        apng_bytes = tf.read()
-
-    def to_data_url(mime: str, data: bytes) -> str:
-        return f"data:{mime};base64," + base64.b64encode(data).decode("ascii")
-
-    return JSONResponse(
-        {
-            "png": to_data_url("image/png", png_bytes),
-            "jpg": to_data_url("image/jpeg", jpg_bytes),
-            "webp": to_data_url("image/webp", webp_bytes),
-            "apng": to_data_url("image/apng", apng_bytes),
-        }
-    )
+    pool = app.state.pool
+    try:
+        outputs = await asyncio.get_running_loop().run_in_executor(pool, job)
+    except BrokenProcessPool:
+        # A worker died (e.g. OOM-killed), which leaves the whole pool unusable. Replace it once,
+        # even if several in-flight requests hit this, and fail only the affected requests
+        if app.state.pool is pool:
+            app.state.pool = _make_pool()
+            _warm_pool(app.state.pool)
+            pool.shutdown(wait=False, cancel_futures=True)
+        raise HTTPException(status_code=503, detail="Enhancement worker crashed, please retry")
+
+    job_id = _store_result(outputs)
+    return JSONResponse({fmt: f"/api/result/{job_id}/{fmt}" for fmt in _MIME_TYPES})
@@ -1,15 +1,14 @@
-import React, { useMemo, useState } from 'react'
+import React, { useState } from 'react'
 
 const API_BASE = (import.meta as any).env?.VITE_API_BASE || 'http://localhost:8000'
 
-function dataUrlToBlob(dataUrl: string): Blob {
-  const [header, base64] = dataUrl.split(',')
-  const mimeMatch = header.match(/data:(.*);base64/)
-  const mime = mimeMatch ? mimeMatch[1] : 'application/octet-stream'
-  const bytes = atob(base64)
-  const buf = new Uint8Array(bytes.length)
-  for (let i = 0; i < bytes.length; i++) buf[i] = bytes.charCodeAt(i)
-  return new Blob([buf], { type: mime })
+const FORMATS = ['png', 'jpg', 'webp', 'apng'] as const
+type Format = typeof FORMATS[number]
+
+async function fetchResultUrl(path: string): Promise<string> {
+  const res = await fetch(`${API_BASE}${path}`)
+  if (!res.ok) throw new Error(`API error: ${res.status}`)
+  return URL.createObjectURL(await res.blob())
 }
 
 export default function App() {
@@ -26,12 +25,8 @@ export default function App() {
   const [sharpenSigma, setSharpenSigma] = useState(1.2)
   const [saturation, setSaturation] = useState(1.05)
 
-  const [result, setResult] = useState<{
-    png?: string
-    jpg?: string
-    webp?: string
-    apng?: string
-  } | null>(null)
+  // Object URLs for the binary results fetched from the API
+  const [result, setResult] = useState<Partial<Record<Format, string>> | null>(null)
 
   const canSubmit = !!file && !busy
 
@@ -40,6 +35,7 @@ export default function App() {
     if (!file) return
     setBusy(true)
     setError(null)
+    if (result) Object.values(result).forEach(url => url && URL.revokeObjectURL(url))
     setResult(null)
 
     const form = new FormData()
@@ -62,8 +58,9 @@ export default function App() {
     try {
       const res = await fetch(`${API_BASE}/api/enhance`, { method: 'POST', body: form })
       if (!res.ok) throw new Error(`API error: ${res.status}`)
-      const data = await res.json()
-      setResult(data)
+      const data: Record<Format, string> = await res.json()
+      const urls = await Promise.all(FORMATS.map(fmt => fetchResultUrl(data[fmt])))
+      setResult(Object.fromEntries(FORMATS.map((fmt, i) => [fmt, urls[i]])))
     } catch (err: any) {
       setError(err?.message || 'Unknown error')
     } finally {
@@ -71,12 +68,10 @@ export default function App() {
     }
   }
 
-  function DownloadButton({ label, dataUrl, filename }: { label: string, dataUrl?: string, filename: string }) {
-    if (!dataUrl) return null
-    const blob = useMemo(() => dataUrlToBlob(dataUrl), [dataUrl])
-    const href = useMemo(() => URL.createObjectURL(blob), [blob])
+  function DownloadButton({ label, url, filename }: { label: string, url?: string, filename: string }) {
+    if (!url) return null
     return (
-      <a href={href} download={filename}>
+      <a href={url} download={filename}>
         <button type="button">Download {label}</button>
       </a>
     )
@@ -152,10 +147,10 @@ export default function App() {
           <h2>Result</h2>
           {result.png && <img className="preview" src={result.png} alt="Preview" />}
           <div className="row" style={{marginTop: 12}}>
-            <DownloadButton label="PNG" dataUrl={result.png} filename="image_enhanced.png" />
-            <DownloadButton label="JPG" dataUrl={result.jpg} filename="image_enhanced.jpg" />
-            <DownloadButton label="WEBP" dataUrl={result.webp} filename="image_enhanced.webp" />
-            <DownloadButton label="APNG" dataUrl={result.apng} filename="image_enhanced.apng" />
+            <DownloadButton label="PNG" url={result.png} filename="image_enhanced.png" />
+            <DownloadButton label="JPG" url={result.jpg} filename="image_enhanced.jpg" />
+            <DownloadButton label="WEBP" url={result.webp} filename="image_enhanced.webp" />
+            <DownloadButton label="APNG" url={result.apng} filename="image_enhanced.apng" />
           </div>
         </div>
       )}